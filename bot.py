@@ -12,8 +12,15 @@ Features:
 """
 
 import os
+import re
 import json
+from time import monotonic
+import atexit
 import asyncio
+import functools
+import contextlib
+import tempfile
+import threading
 from datetime import datetime, timedelta, time
 from zoneinfo import ZoneInfo
 
@@ -31,9 +38,10 @@ from telegram.ext import (
     filters,
 )
 
-from providers import LLMProvider
+from providers import LLMProvider, STREAM_REPLIES, aclose_http_client
 from memory import update_memory
 from vision_provider import describe_image
+from semantic_cache import make_key as make_semantic_key
 
 # --- Basic config & paths ---
 
@@ -52,6 +60,7 @@ QUIET_END = os.getenv("QUIET_END", "09:00")
 
 CHAT_WINDOW_LINES = int(os.getenv("CHAT_WINDOW_LINES", "150"))
 CHAT_BUFFER_MAX_LINES = int(os.getenv("CHAT_BUFFER_MAX_LINES", "300"))
+CHAT_SUMMARY_MAX_CHARS = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "20000"))
 
 STATE_FILE = os.path.join(BASE_DIR, "state.json")
 DAILY_LOG = os.path.join(BASE_DIR, "data", "chat_today.txt")
@@ -86,206 +95,529 @@ def load_state():
 
 
 def save_state(st: dict):
-    with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(st, f)
+    # Write to a unique temp file and rename so a crash never leaves a torn
+    # state.json (and concurrent writers never share a temp file)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(STATE_FILE), prefix=".state.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(st, f)
+        os.replace(tmp, STATE_FILE)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
 
 
 state = load_state()
 
+# Writes are debounced: handlers only mark the state dirty and
+# state_flush_loop() persists it at most once per STATE_FLUSH_SEC.
+STATE_FLUSH_SEC = 1
+_state_dirty = False
 
-# --- Time helpers / quiet hours ---
 
-def now_tz() -> datetime:
-    return datetime.now(ZoneInfo(QUIET_TZ))
+def _mark_state_dirty():
+    global _state_dirty
+    _state_dirty = True
+
+
+_state_lock = threading.Lock()  # flushes come from worker threads and atexit
+
+
+def _flush_state():
+    """
+    Write state.json if it has pending changes. On failure the change stays
+    pending for the next flush.
+    """
+    global _state_dirty
+    with _state_lock:
+        if not _state_dirty:
+            return
+        _state_dirty = False
+        try:
+            save_state(dict(state))
+        except Exception:
+            _state_dirty = True
+            raise
+
 
+atexit.register(_flush_state)
+
+
+async def state_flush_loop():
+    """
+    Background task that writes state.json when it has pending changes.
+    """
+    while True:
+        await asyncio.sleep(STATE_FLUSH_SEC)
+        if not _state_dirty:
+            continue
+        try:
+            await asyncio.to_thread(_flush_state)
+        except Exception:
+            pass  # still pending; retried on the next tick
+
+
+# --- Time helpers / quiet hours ---
 
 def parse_hhmm(s: str) -> time:
     hh, mm = s.split(":")
     return time(hour=int(hh), minute=int(mm))
 
 
+# Parsed once at import; these settings do not change at runtime
+_QUIET_ZI = ZoneInfo(QUIET_TZ)
+_QUIET_START_T = parse_hhmm(QUIET_START)
+_QUIET_END_T = parse_hhmm(QUIET_END)
+_QUIET_CROSSES_MIDNIGHT = _QUIET_START_T > _QUIET_END_T
+
+
+def now_tz() -> datetime:
+    return datetime.now(_QUIET_ZI)
+
+
 def is_quiet(dt: datetime) -> bool:
     """
     Return True if dt is within the configured quiet-hours window.
     Handles windows that cross midnight (e.g. 23:00–09:00).
     """
-    start_t = parse_hhmm(QUIET_START)
-    end_t = parse_hhmm(QUIET_END)
     t = dt.time()
 
-    if start_t > end_t:  # crosses midnight
-        return (t >= start_t) or (t < end_t)
-    return start_t <= t < end_t
+    if _QUIET_CROSSES_MIDNIGHT:
+        return (t >= _QUIET_START_T) or (t < _QUIET_END_T)
+    return _QUIET_START_T <= t < _QUIET_END_T
 
 
 # --- LLM message builder ---
 
+# Everything but the timestamp is fixed at startup, so the template is built once.
+# Braces in the persona/style files are escaped so str.format leaves them alone.
+_SYSTEM_PROMPT_TEMPLATE = (
+    f"{CHAR_PROMPT}\n\n{STYLE_PROMPT}".replace("{", "{{").replace("}", "}}")
+    + "\n\n"
+    "Current local time is {current_time}.\n"
+    "Do not explicitly mention the time or reveal the exact timestamp.\n"
+    "When you need to send multiple messages, separate them with a backslash '\\'."
+)
+
+# (minute, system message) – reused until the minute rolls over
+_system_msg_cache: tuple[datetime | None, dict] = (None, {})
+
+
 def build_messages(user_text: str):
     """
     Build a message list for the LLM, injecting persona/style and current time.
     """
-    now_local = now_tz()
-    current_time = now_local.strftime("%Y-%m-%d %H:%M")
-
-    system_prompt = (
-        f"{CHAR_PROMPT}\n\n"
-        f"{STYLE_PROMPT}\n\n"
-        f"Current local time is {current_time}.\n"
-        "Do not explicitly mention the time or reveal the exact timestamp.\n"
-        "When you need to send multiple messages, separate them with a backslash '\\'."
-    )
+    global _system_msg_cache
+
+    minute = now_tz().replace(second=0, microsecond=0)
+    cached_minute, system_msg = _system_msg_cache
+    if cached_minute != minute:
+        current_time = minute.strftime("%Y-%m-%d %H:%M")
+        system_msg = {
+            "role": "system",
+            "content": _SYSTEM_PROMPT_TEMPLATE.format(current_time=current_time),
+        }
+        _system_msg_cache = (minute, system_msg)
 
     return [
-        {"role": "system", "content": system_prompt},
+        system_msg,
         {"role": "user", "content": user_text},
     ]
 
 
 # --- Chat logging and memory windowing ---
 
-CHAT_LOG = []
-MAX_LOG_LINES = 100
+# CHAT_LOG keeps the tail of the non-empty lines in DAILY_LOG (pending lines
+# included), sized so that it usually holds the whole file when summarizing.
+MAX_LOG_LINES = max(100, 2 * CHAT_BUFFER_MAX_LINES)
+
+# Daily-log lines are buffered in memory and appended to DAILY_LOG in batches
+LOG_FLUSH_LINES = 32
+LOG_FLUSH_BYTES = 1 << 16
+LOG_FLUSH_SEC = 2
+
+_pending_lines: list[str] = []
+_pending_bytes = 0
+_last_flush = monotonic()
+
+
+def _open_daily_log():
+    return open(DAILY_LOG, "a", encoding="utf-8", buffering=1 << 16)
+
+
+# One append handle is kept open for the whole process lifetime.
+# All log writes happen on the event-loop thread, so no lock is needed.
+os.makedirs(os.path.dirname(DAILY_LOG), exist_ok=True)
+_daily_log_fp = _open_daily_log()
+
+
+def _rewrite_daily_log(text: str):
+    """
+    Replace the contents of DAILY_LOG and reopen the shared append handle.
+    """
+    global _daily_log_fp
+    _daily_log_fp.close()
+    with open(DAILY_LOG, "w", encoding="utf-8") as f:
+        f.write(text)
+    _daily_log_fp = _open_daily_log()
 
 
 def load_daily_log() -> str:
-    if os.path.exists(DAILY_LOG):
-        with open(DAILY_LOG, "r", encoding="utf-8") as f:
-            return f.read()
-    return ""
+    try:
+        if os.stat(DAILY_LOG).st_size == 0:
+            return ""
+    except FileNotFoundError:
+        return ""
+    with open(DAILY_LOG, "r", encoding="utf-8") as f:
+        return f.read()
 
 
 def clear_daily_log():
-    global CHAT_LOG
+    global CHAT_LOG, _pending_bytes, _daily_line_count
     CHAT_LOG.clear()
-    with open(DAILY_LOG, "w", encoding="utf-8") as f:
-        f.write("")
+    _pending_lines.clear()
+    _pending_bytes = 0
+    _daily_line_count = 0
+    _rewrite_daily_log("")
 
 
-def maybe_summarize_chatlog():
+async def maybe_summarize_chatlog():
     """
     Sliding window:
     - If chat_today.txt exceeds CHAT_BUFFER_MAX_LINES,
-      summarize the oldest CHAT_WINDOW_LINES lines into long-term memory,
-      keep only the remaining lines in the log.
+      summarize all lines beyond the newest
+      (CHAT_BUFFER_MAX_LINES - CHAT_WINDOW_LINES) into long-term memory
+      in a single call, keep only the remaining lines in the log.
+    - A single batch is capped at CHAT_SUMMARY_MAX_CHARS; any leftover
+      overflow is picked up on the next pass.
+
+    The log is trimmed on the event loop before awaiting the summary, so lines
+    appended while the (blocking) memory model call runs in a worker thread
+    are never lost.
     """
-    global CHAT_LOG
+    global CHAT_LOG, _daily_line_count
+
+    # Cheap check first: only touch the disk once the threshold is crossed
+    if _daily_line_count <= CHAT_BUFFER_MAX_LINES:
+        return
 
-    text = load_daily_log()
-    lines = [ln for ln in text.splitlines() if ln.strip()]
+    _flush_log()
+    if len(CHAT_LOG) >= _daily_line_count:
+        # The in-memory tail already holds the whole file
+        lines = CHAT_LOG[-_daily_line_count:]
+    else:
+        text = load_daily_log()
+        lines = [ln for ln in text.splitlines() if ln.strip()]
     if len(lines) <= CHAT_BUFFER_MAX_LINES:
+        _daily_line_count = len(lines)
         return
 
-    window_size = min(CHAT_WINDOW_LINES, len(lines))
+    # Batch the whole overflow (e.g. after downtime) into one summary call
+    overflow = len(lines) - max(0, CHAT_BUFFER_MAX_LINES - CHAT_WINDOW_LINES)
+    window_size = 0
+    chunk_chars = 0
+    for ln in lines[:overflow]:
+        chunk_chars += len(ln) + 1
+        if window_size and chunk_chars > CHAT_SUMMARY_MAX_CHARS:
+            break
+        window_size += 1
+
     chunk_lines = lines[:window_size]
     remain_lines = lines[window_size:]
 
     chunk_text = "\n".join(chunk_lines)
     remain_text = "\n".join(remain_lines)
 
+    _rewrite_daily_log(remain_text + "\n" if remain_text else "")
+
+    CHAT_LOG = remain_lines[-MAX_LOG_LINES:]
+    _daily_line_count = len(remain_lines)
+
     try:
         if chunk_text.strip():
-            update_memory(chunk_text)
+            await asyncio.to_thread(update_memory, chunk_text)
     except Exception:
         # Intentionally swallow errors: memory failure should not crash the bot
         pass
 
-    with open(DAILY_LOG, "w", encoding="utf-8") as f:
-        if remain_text:
-            f.write(remain_text + "\n")
-        else:
-            f.write("")
 
-    CHAT_LOG = remain_lines[-MAX_LOG_LINES:]
+def _flush_log():
+    """
+    Write all pending log lines to DAILY_LOG with a single append.
+    """
+    global _pending_bytes, _last_flush
+
+    _last_flush = monotonic()
+    if not _pending_lines:
+        return
+
+    _daily_log_fp.write("\n".join(_pending_lines) + "\n")
+    _daily_log_fp.flush()
+
+    _pending_lines.clear()
+    _pending_bytes = 0
+
+
+def _close_daily_log():
+    _flush_log()
+    _daily_log_fp.close()
+
+
+atexit.register(_close_daily_log)
+
+
+def _scan_daily_log():
+    """
+    Read DAILY_LOG once at startup: count its non-empty lines and keep the tail.
+    """
+    lines = [ln for ln in load_daily_log().splitlines() if ln.strip()]
+    return len(lines), lines[-MAX_LOG_LINES:]
+
+
+# Non-empty lines currently in DAILY_LOG (pending lines included)
+_daily_line_count, CHAT_LOG = _scan_daily_log()
 
 
 def log_append(line: str):
-    CHAT_LOG.append(line)
+    global _pending_bytes, _daily_line_count
+
+    # A single entry may span several lines (multi-line replies)
+    new_lines = [ln for ln in line.splitlines() if ln.strip()]
+    CHAT_LOG.extend(new_lines)
     if len(CHAT_LOG) > MAX_LOG_LINES:
-        del CHAT_LOG[0]
+        del CHAT_LOG[:-MAX_LOG_LINES]
+    _daily_line_count += len(new_lines)
+
+    _pending_lines.append(line)
+    _pending_bytes += len(line) + 1
 
-    os.makedirs(os.path.dirname(DAILY_LOG), exist_ok=True)
-    with open(DAILY_LOG, "a", encoding="utf-8") as f:
-        f.write(line + "\n")
+    if (
+        len(_pending_lines) >= LOG_FLUSH_LINES
+        or _pending_bytes >= LOG_FLUSH_BYTES
+        or monotonic() - _last_flush >= LOG_FLUSH_SEC
+    ):
+        _flush_log()
 
-    maybe_summarize_chatlog()
+
+async def log_flush_loop():
+    """
+    Background task that flushes buffered log lines every LOG_FLUSH_SEC seconds
+    and runs the sliding-window summarization when the log has grown too long.
+    """
+    while True:
+        await asyncio.sleep(LOG_FLUSH_SEC)
+        try:
+            _flush_log()
+            await maybe_summarize_chatlog()
+        except Exception:
+            # Do not crash the flush loop on disk / memory failures
+            pass
 
 
 # --- Multi-part sending ---
 
+# One or more consecutive backslashes separate message parts
+_SPLIT_RE = re.compile(r"\\+")
+
+# Telegram's hard limit is 4096 characters per message
+MAX_MESSAGE_CHARS = 4000
+
+
+def _chunks(s: str, n: int = MAX_MESSAGE_CHARS):
+    for i in range(0, len(s), n):
+        yield s[i:i + n]
+
+
 async def send_split_to_chat(bot, chat_id: int, text: str):
     """
-    Support backslash-separated segments and chunking into <= 3500-char messages.
+    Support backslash-separated segments and chunking into <= 4000-char messages.
+
+    SPLIT_DELAY is only applied between backslash-separated parts; slices of
+    one oversized part are sent back to back (in order).
     """
-    parts = [p.strip() for p in text.split("\\") if p.strip()]
+    parts = [s for s in (p.strip() for p in _SPLIT_RE.split(text)) if s]
     if not parts:
         parts = [text]
 
-    for part in parts:
-        chunks = [part[i:i + 3500] for i in range(0, len(part), 3500)]
-        for c in chunks:
+    send = functools.partial(bot.send_message, chat_id=chat_id, parse_mode=ParseMode.HTML)
+
+    for n, part in enumerate(parts):
+        if n > 0:
             await asyncio.sleep(SPLIT_DELAY)
-            await bot.send_message(
-                chat_id=chat_id,
-                text=c,
-                parse_mode=ParseMode.HTML,
-            )
+        for c in _chunks(part):
+            await send(text=c)
+
+
+async def send_streamed_to_chat(bot, chat_id: int, stream) -> str:
+    """
+    Streaming counterpart of send_split_to_chat(): each backslash-separated
+    part is sent as soon as it is complete, instead of after the full reply.
+    Returns the full reply text.
+    """
+    send = functools.partial(bot.send_message, chat_id=chat_id, parse_mode=ParseMode.HTML)
+    received = []
+    pending = ""
+    sent = 0
+
+    async def send_part(part: str):
+        nonlocal sent
+        part = part.strip()
+        if not part:
+            return
+        if sent:
+            await asyncio.sleep(SPLIT_DELAY)
+        for c in _chunks(part):
+            await send(text=c)
+        sent += 1
+
+    # aclosing: if sending fails, stop the provider stream right away
+    async with contextlib.aclosing(stream):
+        async for chunk in stream:
+            received.append(chunk)
+            # Everything before the last separator is complete
+            *done, pending = _SPLIT_RE.split(pending + chunk)
+            for part in done:
+                await send_part(part)
+
+    await send_part(pending)
+
+    text = "".join(received)
+    if not sent and text:
+        for c in _chunks(text):
+            await send(text=c)
+    return text
+
+
+# --- Auto-nudge timer ---
+
+# Lower bound for any nudge timer, so a zero cooldown or a failing
+# nudge cannot turn into a busy loop
+NUDGE_MIN_DELAY_SEC = 15
+
+# Parsed copies of state["last_user_ts"] / state["last_nudge_ts"]
+_last_user_dt: datetime | None = None
+_last_nudge_dt: datetime | None = None
+
+# The single pending nudge timer (re-armed on every user message)
+_nudge_handle: asyncio.TimerHandle | None = None
+
+
+def _parse_state_ts(key: str) -> datetime | None:
+    ts = state.get(key)
+    if not ts:
+        return None
+    return datetime.fromisoformat(ts).astimezone(_QUIET_ZI)
+
+
+def _next_quiet_end(now: datetime) -> datetime:
+    end = now.replace(
+        hour=_QUIET_END_T.hour, minute=_QUIET_END_T.minute, second=0, microsecond=0
+    )
+    if end <= now:
+        end += timedelta(days=1)
+    return end
 
 
-# --- Auto-nudge loop ---
+def _nudge_due_time() -> datetime | None:
+    """
+    Earliest moment a nudge may be sent, ignoring quiet hours.
+    None if the user has never spoken.
+    """
+    if _last_user_dt is None:
+        return None
+    due_time = _last_user_dt + timedelta(minutes=NUDGE_DELAY_MIN)
+    if _last_nudge_dt is not None:
+        due_time = max(due_time, _last_nudge_dt + timedelta(minutes=NUDGE_COOLDOWN_MIN))
+    return due_time
+
+
+def _schedule_nudge(app, at: datetime | None = None):
+    """
+    (Re)arm the nudge timer for `at`, or for the next due moment by default.
+    Any previously armed timer is cancelled.
+    """
+    global _nudge_handle
+
+    if _nudge_handle is not None:
+        _nudge_handle.cancel()
+        _nudge_handle = None
+
+    if OWNER_CHAT_ID == 0:
+        return
+    if at is None:
+        at = _nudge_due_time()
+        if at is None:
+            return
 
-async def nudge_loop(app):
+    delay = max(NUDGE_MIN_DELAY_SEC, (at - now_tz()).total_seconds())
+    loop = asyncio.get_running_loop()
+    _nudge_handle = loop.call_later(delay, lambda: app.create_task(_fire_nudge(app)))
+
+
+def start_nudge_timer(app):
+    """
+    Restore activity timestamps from state.json and arm the first nudge timer.
+    Must run inside the event loop (post_init).
     """
-    Background task that periodically checks for inactivity.
+    global _last_user_dt, _last_nudge_dt
+
+    _last_user_dt = _parse_state_ts("last_user_ts")
+    _last_nudge_dt = _parse_state_ts("last_nudge_ts")
+    _schedule_nudge(app)
+
+
+async def _fire_nudge(app):
+    """
+    Timer callback for inactivity nudges.
     If:
       - user has spoken at least once,
       - last message is older than NUDGE_DELAY_MIN,
       - last nudge is older than NUDGE_COOLDOWN_MIN,
       - and current time is outside quiet hours,
-    the bot sends a proactive message.
+    the bot sends a proactive message. Otherwise the timer is re-armed for
+    the next moment a nudge could be due (or for the end of quiet hours).
     """
-    while True:
-        await asyncio.sleep(15)
-        try:
-            if OWNER_CHAT_ID == 0:
-                continue
-
-            now = now_tz()
-            if is_quiet(now):
-                continue
-
-            last_user_ts = state.get("last_user_ts")
-            if not last_user_ts:
-                continue
-
-            last_user = datetime.fromisoformat(last_user_ts).astimezone(ZoneInfo(QUIET_TZ))
-            due_time = last_user + timedelta(minutes=NUDGE_DELAY_MIN)
-
-            last_nudge_ts = state.get("last_nudge_ts")
-            if last_nudge_ts:
-                last_nudge = datetime.fromisoformat(last_nudge_ts).astimezone(ZoneInfo(QUIET_TZ))
-                if (now - last_nudge) < timedelta(minutes=NUDGE_COOLDOWN_MIN):
-                    continue
-
-            if now >= due_time:
-                # CUSTOMIZE: how the model should phrase proactive check-ins
-                nudge_user_text = (
-                    f"The user has been silent for {NUDGE_DELAY_MIN} minutes.\n"
-                    "As an emotional-support assistant, send a brief, proactive check-in.\n"
-                    "- Keep the tone gentle and non-intrusive.\n"
-                    "- You may express that you noticed their silence, or offer a small topic or question.\n"
-                    "- Use backslashes '\\' to split into several shorter messages."
-                )
-                msgs = build_messages(nudge_user_text)
-                reply = await llm.chat(msgs)
-
-                await send_split_to_chat(app.bot, OWNER_CHAT_ID, reply)
-                state["last_nudge_ts"] = now.isoformat()
-                save_state(state)
-                log_append(f"BOT: {reply}")
+    global _last_nudge_dt, _nudge_handle
 
-        except Exception:
-            # Do not crash the main loop on nudge failures
-            pass
+    _nudge_handle = None
+    try:
+        now = now_tz()
+        due_time = _nudge_due_time()
+        if due_time is None:
+            return
+
+        if now < due_time:
+            _schedule_nudge(app, due_time)
+            return
+
+        if is_quiet(now):
+            _schedule_nudge(app, _next_quiet_end(now))
+            return
+
+        # CUSTOMIZE: how the model should phrase proactive check-ins
+        nudge_user_text = (
+            f"The user has been silent for {NUDGE_DELAY_MIN} minutes.\n"
+            "As an emotional-support assistant, send a brief, proactive check-in.\n"
+            "- Keep the tone gentle and non-intrusive.\n"
+            "- You may express that you noticed their silence, or offer a small topic or question.\n"
+            "- Use backslashes '\\' to split into several shorter messages."
+        )
+        msgs = build_messages(nudge_user_text)
+        reply = await llm.chat(msgs)
+
+        await send_split_to_chat(app.bot, OWNER_CHAT_ID, reply)
+        state["last_nudge_ts"] = now.isoformat()
+        _last_nudge_dt = now
+        _mark_state_dirty()
+        log_append(f"BOT: {reply}")
+
+        # Still silent after the cooldown → check in again
+        _schedule_nudge(app)
+
+    except Exception:
+        # Do not drop the timer on nudge failures; retry a bit later
+        _schedule_nudge(app, now_tz())
 
 
 # --- Commands ---
@@ -303,7 +635,7 @@ async def ping_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # --- Text messages ---
 
 async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global state
+    global state, _last_user_dt
 
     if not update.message:
         return
@@ -312,16 +644,26 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     user = update.effective_user.first_name or "User"
+    # Semantic cache key: this turn in the context of the line before it
+    semantic_key = make_semantic_key(text, CHAT_LOG[-1] if CHAT_LOG else "")
     log_append(f"{user}: {text}")
 
-    state["last_user_ts"] = now_tz().isoformat()
-    save_state(state)
+    now = now_tz()
+    state["last_user_ts"] = now.isoformat()
+    _last_user_dt = now
+    _mark_state_dirty()
+    _schedule_nudge(context.application)
 
     msgs = build_messages(text)
-    reply = await llm.chat(msgs)
-
     chat_id = update.effective_chat.id
-    await send_split_to_chat(context.bot, chat_id, reply)
+
+    if STREAM_REPLIES:
+        reply = await send_streamed_to_chat(
+            context.bot, chat_id, llm.chat_stream(msgs, semantic_key=semantic_key)
+        )
+    else:
+        reply = await llm.chat(msgs, semantic_key=semantic_key)
+        await send_split_to_chat(context.bot, chat_id, reply)
     log_append(f"BOT: {reply}")
 
 
@@ -334,7 +676,7 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
       2) Convert it to a textual description via describe_image().
       3) Ask the LLM to reply based on that description.
     """
-    global state
+    global state, _last_user_dt
 
     if not update.message or not update.message.photo:
         return
@@ -344,14 +686,20 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user.first_name or "User"
     log_append(f"{user}: [photo sent]")
 
-    state["last_user_ts"] = now_tz().isoformat()
-    save_state(state)
+    now = now_tz()
+    state["last_user_ts"] = now.isoformat()
+    _last_user_dt = now
+    _mark_state_dirty()
+    _schedule_nudge(context.application)
 
     photo = update.message.photo[-1]
     file = await context.bot.get_file(photo.file_id)
     img_bytes = await file.download_as_bytearray()
 
-    raw_desc = describe_image(bytes(img_bytes), "Please describe this image in detail.")
+    # Pass a zero-copy view; describe_image accepts any bytes-like object
+    raw_desc = await asyncio.to_thread(
+        describe_image, memoryview(img_bytes), "Please describe this image in detail."
+    )
     if not raw_desc or "error" in raw_desc.lower():
         # CUSTOMIZE: fallback wording on vision failure
         fallback = (
@@ -395,10 +743,23 @@ if __name__ == "__main__":
     app.add_handler(MessageHandler(filters.PHOTO & ~filters.COMMAND, on_photo))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_message))
 
+    state_task: list[asyncio.Task] = []
+
     async def start_nudge(app_):
-        app_.create_task(nudge_loop(app_))
+        start_nudge_timer(app_)
+        app_.create_task(log_flush_loop())
+        state_task.append(app_.create_task(state_flush_loop()))
+
+    async def flush_on_shutdown(app_):
+        for task in state_task:
+            task.cancel()
+        try:
+            await asyncio.to_thread(_flush_state)
+        finally:
+            await aclose_http_client()
 
     app.post_init = start_nudge
+    app.post_shutdown = flush_on_shutdown
 
     print("Bot is running...")
     app.run_polling()
\ No newline at end of file
@@ -27,61 +27,80 @@ else:
 # Target length for a single memory summary (characters; best-effort)
 MEMORY_SUMMARY_CHARS = int(os.getenv("MEMORY_SUMMARY_CHARS", "400"))
 
+# Optional dedicated model / params for memory summaries (OpenRouter)
+MEMORY_MODEL = os.getenv("MEMORY_MODEL", "").strip()
+MEMORY_TEMPERATURE = float(os.getenv("MEMORY_TEMPERATURE", "0.3"))
+MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", "700"))
+
+# memory.txt is only compacted back to MAX_MEMORY_CHARS once it grows past this ratio
+MEMORY_COMPACT_RATIO = 1.5
+
+# Byte size of memory.txt right after the last compaction (compaction
+# threshold baseline). Starts at one byte per character; the first
+# compaction of a multi-byte file raises it to the real size.
+_COMPACTED_BYTES = MAX_MEMORY_CHARS or 0
+
+
+# (mtime_ns, size, text) of the last load_memory() result
+_MEMORY_CACHE: tuple[int, int, str] | None = None
+
 
 def load_memory() -> str:
     """
     Load the long-term memory file, optionally clipping to the last MAX_MEMORY_CHARS.
+
+    When clipping, only the tail of the file is read from disk. The result is
+    reused until the file's mtime or size changes.
     """
-    if not os.path.exists(MEMORY_FILE):
+    global _MEMORY_CACHE
+
+    try:
+        st = os.stat(MEMORY_FILE)
+    except FileNotFoundError:
         return ""
-    with open(MEMORY_FILE, "r", encoding="utf-8") as f:
-        text = f.read()
-    if MAX_MEMORY_CHARS is None:
-        return text
-    return text[-MAX_MEMORY_CHARS:]
+    if st.st_size == 0:
+        return ""
+
+    cached = _MEMORY_CACHE
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+
+    # Fewer bytes than the cap means fewer characters too: read it all
+    if MAX_MEMORY_CHARS is None or st.st_size <= MAX_MEMORY_CHARS:
+        with open(MEMORY_FILE, "r", encoding="utf-8") as f:
+            text = f.read()
+    else:
+        # A UTF-8 character is at most 4 bytes, so this tail covers MAX_MEMORY_CHARS;
+        # a partial character at the cut is dropped by errors="ignore"
+        with open(MEMORY_FILE, "rb") as f:
+            f.seek(max(0, st.st_size - 4 * MAX_MEMORY_CHARS))
+            data = f.read()
+        text = data.decode("utf-8", errors="ignore")[-MAX_MEMORY_CHARS:]
+
+    _MEMORY_CACHE = (st.st_mtime_ns, st.st_size, text)
+    return text
 
 
 def _call_memory_model(prompt: str) -> str:
     """
     Thin wrapper around providers.ask_ai() dedicated to memory summarization.
 
-    If MEMORY_MODEL is set, this temporarily overrides the OpenRouter model
-    and generation params while producing the summary, then restores them.
+    If MEMORY_MODEL is set, the OpenRouter model and generation params are
+    overridden for this call only (passed per call, so concurrent summaries
+    cannot clobber each other).
     """
     import providers
 
-    MEMORY_MODEL = os.getenv("MEMORY_MODEL", "").strip()
-    MEMORY_TEMPERATURE = float(os.getenv("MEMORY_TEMPERATURE", "0.3"))
-    MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", "700"))
-
     # No dedicated memory model → use the default provider routing
     if not MEMORY_MODEL:
         return providers.ask_ai(prompt)
 
-    # Temporarily override OpenRouter settings
-    old_model = getattr(providers, "OPENROUTER_MODEL", None)
-    old_temp = getattr(providers, "OPENROUTER_TEMPERATURE", None)
-    old_max = getattr(providers, "OPENROUTER_MAX_TOKENS", None)
-
-    if old_model is not None:
-        providers.OPENROUTER_MODEL = MEMORY_MODEL
-    if old_temp is not None:
-        providers.OPENROUTER_TEMPERATURE = MEMORY_TEMPERATURE
-    if old_max is not None:
-        providers.OPENROUTER_MAX_TOKENS = MEMORY_MAX_TOKENS
-
-    try:
-        summary = providers.ask_ai(prompt)
-    finally:
-        # Restore previous settings
-        if old_model is not None:
-            providers.OPENROUTER_MODEL = old_model
-        if old_temp is not None:
-            providers.OPENROUTER_TEMPERATURE = old_temp
-        if old_max is not None:
-            providers.OPENROUTER_MAX_TOKENS = old_max
-
-    return summary
+    return providers.ask_ai(
+        prompt,
+        model=MEMORY_MODEL,
+        temperature=MEMORY_TEMPERATURE,
+        max_tokens=MEMORY_MAX_TOKENS,
+    )
 
 
 def summarize_chat(conversation: str) -> str:
@@ -159,18 +178,38 @@ Now output ONE complete memory entry in the exact format described above.
 def write_memory(fragment: str) -> None:
     """
     Append a single memory entry to memory.txt and enforce MAX_MEMORY_CHARS.
-    """
-    old = load_memory()
-    new = (old + "\n\n" + fragment.strip()).strip()
 
-    if MAX_MEMORY_CHARS is None:
-        clipped = new
-    else:
-        clipped = new[-MAX_MEMORY_CHARS:]
+    Entries are appended in place; the file is only rewritten (clipped to
+    MAX_MEMORY_CHARS) once it grows past MEMORY_COMPACT_RATIO times its size
+    after the last compaction. Sizes are compared in bytes, so multi-byte
+    (e.g. Chinese) text does not trigger a rewrite on every write.
+    """
+    global _COMPACTED_BYTES
 
+    fragment = fragment.strip()
     os.makedirs(DATA_DIR, exist_ok=True)
-    with open(MEMORY_FILE, "w", encoding="utf-8") as f:
-        f.write(clipped)
+
+    try:
+        size = os.stat(MEMORY_FILE).st_size
+    except FileNotFoundError:
+        size = 0
+
+    if (
+        MAX_MEMORY_CHARS is None
+        or size + len(fragment.encode("utf-8")) < MEMORY_COMPACT_RATIO * _COMPACTED_BYTES
+    ):
+        with open(MEMORY_FILE, "a", encoding="utf-8") as f:
+            f.write(("\n\n" + fragment) if size else fragment)
+        return
+
+    # Compaction: rewrite the file with only the newest MAX_MEMORY_CHARS
+    with open(MEMORY_FILE, "r", encoding="utf-8") as f:
+        old = f.read()
+    new = (old + "\n\n" + fragment).strip()[-MAX_MEMORY_CHARS:]
+    data = new.encode("utf-8")
+    with open(MEMORY_FILE, "wb") as f:
+        f.write(data)
+    _COMPACTED_BYTES = max(len(data), MAX_MEMORY_CHARS)
 
 
 def update_memory(conversation: str) -> None:
@@ -6,33 +6,72 @@ Model provider orchestration.
 - Injects recent chat log and long-term memory into a single prompt
 - Exposes:
     - ask_ai(prompt: str) -> str
+    - ask_ai_async(prompt: str) -> str (runs ask_ai off the event loop)
+    - ask_ai_stream(prompt: str) / ask_ai_stream_async(prompt: str) (reply chunks)
     - LLMProvider.chat(messages: list[dict]) -> str (async API for bot.py)
+    - LLMProvider.chat_stream(messages: list[dict]) (async iterator of chunks)
+    - aclose_http_client() (closes the optional httpx client on shutdown)
 """
 
 import os
+import re
+import json
 import time
 import random
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from memory import load_memory
+import semantic_cache
+
+try:
+    import orjson  # optional: faster JSON encoding / parsing
+except ImportError:
+    orjson = None
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
+# (path, max_chars, max_lines) → (mtime_ns, size, result)
+_CHAT_CACHE: dict[tuple[str, int, int], tuple[int, int, str]] = {}
+
+
 def read_recent_chat(path: str, max_chars: int = 1800, max_lines: int = 40) -> str:
     """
     Read the tail of today's chat log as short-term context.
+
+    Only the end of the file is read, and the result is reused until the
+    file's mtime or size changes.
     """
-    if not os.path.exists(path):
-        return ""
-    with open(path, "r", encoding="utf-8") as f:
-        lines = f.read().splitlines()
-    if not lines:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
         return ""
+
+    key = (path, max_chars, max_lines)
+    cached = _CHAT_CACHE.get(key)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+
+    # The result is at most max_chars characters (<= 4 bytes each in UTF-8),
+    # so this tail always contains it; a partial first line is harmless
+    tail_bytes = max(8192, 4 * (max_chars + 2))
+    with open(path, "rb") as f:
+        f.seek(max(0, st.st_size - tail_bytes))
+        text = f.read().decode("utf-8", errors="ignore")
+
+    lines = text.splitlines()
     recent = lines[-max_lines:]
     joined = "\n".join(recent)
-    if len(joined) <= max_chars:
-        return joined
-    return joined[-max_chars:]
+    if len(joined) > max_chars:
+        joined = joined[-max_chars:]
+
+    _CHAT_CACHE[key] = (st.st_mtime_ns, st.st_size, joined)
+    return joined
 
 
 # Debug toggle: controlled via .env (DEBUG_MODE=true/1/on/yes)
@@ -60,11 +99,91 @@ def _get_env_list(name: str):
     return [x.strip() for x in v.split(",") if x.strip()]
 
 
+# --- Shared HTTP session ---
+
+# Same-provider retries on 5xx / connect errors before ask_ai moves on.
+# Read timeouts are not retried: the request already took the full timeout.
+# Once retries run out, requests raises RetryError → "__TEMP_FAIL__".
+PROVIDER_HTTP_RETRIES = int(os.getenv("PROVIDER_HTTP_RETRIES", "2"))
+_RETRY_KW = dict(
+    total=PROVIDER_HTTP_RETRIES,
+    connect=PROVIDER_HTTP_RETRIES,
+    read=0,
+    status=PROVIDER_HTTP_RETRIES,
+    backoff_factor=0.4,
+    status_forcelist=(500, 502, 503, 504),
+    allowed_methods=frozenset(["POST"]),
+    respect_retry_after_header=True,
+)
+try:
+    _RETRY = Retry(backoff_jitter=0.3, **_RETRY_KW)  # urllib3 >= 2
+except TypeError:
+    _RETRY = Retry(**_RETRY_KW)
+
+# One pooled session for all providers keeps TCP/TLS connections warm across calls
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=_RETRY)
+_SESSION.mount("http://", _ADAPTER)
+_SESSION.mount("https://", _ADAPTER)
+
+# Optional async client for ask_ai_async (HTTPX_CLIENT=1): native async
+# requests, one pool shared by all chats, and HTTP/2 multiplexing per
+# provider host when the h2 package is installed. httpx ships with
+# python-telegram-bot; without it the requests session is used.
+HTTPX_CLIENT = os.getenv("HTTPX_CLIENT", "0").lower() in ("1", "true", "yes", "on")
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+_USE_HTTPX = HTTPX_CLIENT and httpx is not None
+_ASYNC_CLIENT = None
+
+
+def _http_client():
+    """
+    Shared httpx.AsyncClient, created on first use inside the running loop.
+    (httpx retries connect errors only; 5xx still fail over as __TEMP_FAIL__.)
+    """
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None or _ASYNC_CLIENT.is_closed:
+        _ASYNC_CLIENT = httpx.AsyncClient(
+            timeout=httpx.Timeout(45.0, connect=5.0),
+            transport=httpx.AsyncHTTPTransport(
+                http2=_HTTP2,
+                retries=PROVIDER_HTTP_RETRIES,
+                limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            ),
+        )
+    return _ASYNC_CLIENT
+
+
+async def aclose_http_client():
+    """
+    Close the shared async client (call on shutdown).
+    """
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is not None:
+        await _ASYNC_CLIENT.aclose()
+        _ASYNC_CLIENT = None
+
+
 # --- Provider-level scheduling configuration ---
 
 PROVIDER_COOLDOWN_MIN = int(os.getenv("PROVIDER_COOLDOWN_MIN", "1"))  # minutes
 PROVIDER_FAILS_BEFORE_SWITCH = int(os.getenv("PROVIDER_FAILS_BEFORE_SWITCH", "2"))
 PROVIDER_STICKY_SEC = int(os.getenv("PROVIDER_STICKY_SEC", "600"))
+# >1: ask_ai_async() races this many providers concurrently (first success wins)
+RACE_PROVIDERS = max(1, int(os.getenv("RACE_PROVIDERS", "1")))
+# Stream Gemini / OpenRouter / Deepseek replies (SSE) via ask_ai_stream()
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "0").lower() in ("1", "true", "yes", "on")
 
 _COOLDOWN: dict[str, float] = {}
 _COOLDOWN_SECONDS = max(5, PROVIDER_COOLDOWN_MIN * 60)  # min 5s
@@ -79,8 +198,44 @@ def _is_cooling(key: str) -> bool:
     return False if not t else (_now() - t < _COOLDOWN_SECONDS)
 
 
+# _mark_bad / _refresh_cooldowns run from several worker threads at once
+_COOLDOWN_LOCK = threading.Lock()
+
+
 def _mark_bad(key: str):
-    _COOLDOWN[key] = _now()
+    with _COOLDOWN_LOCK:
+        _COOLDOWN[key] = _now()
+        provider, _, k = key.partition(":")
+        if k and provider in _ACTIVE:
+            _ACTIVE[provider].discard(k)
+
+
+_LAST_COOLDOWN_REFRESH = 0.0
+
+
+def _refresh_cooldowns():
+    """
+    Return keys whose cooldown has expired to the active pools.
+    Runs at most once per second.
+    """
+    global _LAST_COOLDOWN_REFRESH
+
+    now = _now()
+    if now - _LAST_COOLDOWN_REFRESH < 1.0:
+        return
+
+    with _COOLDOWN_LOCK:
+        if now - _LAST_COOLDOWN_REFRESH < 1.0:
+            return  # another thread refreshed meanwhile
+        _LAST_COOLDOWN_REFRESH = now
+
+        for key, t in list(_COOLDOWN.items()):
+            if now - t < _COOLDOWN_SECONDS:
+                continue
+            del _COOLDOWN[key]
+            provider, _, k = key.partition(":")
+            if k and provider in _ACTIVE:
+                _ACTIVE[provider].add(k)
 
 
 # --- Env-driven configuration ---
@@ -90,10 +245,18 @@ ORDER = [
     for x in os.getenv("PROVIDER_ORDER", "gemini,openrouter").split(",")
     if x.strip()
 ]
+# Normalized once; ask_ai walks this on every call
+_PROVIDERS_ORDER: tuple[str, ...] = tuple(p.lower() for p in ORDER)
 
 # API keys
 GEMINI_KEYS = _get_env_list("GEMINI_API_KEYS")
 OPENROUTER_KEYS = _get_env_list("OPENROUTER_API_KEYS")
+
+# Multi-key providers: keys that are not cooling down right now
+_ACTIVE: dict[str, set[str]] = {
+    "gemini": set(GEMINI_KEYS),
+    "openrouter": set(OPENROUTER_KEYS),
+}
 EDENAI_KEY = os.getenv("EDENAI_API_KEY", "").strip()
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "").strip()
 
@@ -126,120 +289,242 @@ DEEPSEEK_FREQUENCY_PENALTY = float(os.getenv("DEEPSEEK_FREQUENCY_PENALTY", "0.0"
 # Timeouts
 GEMINI_TIMEOUT = int(os.getenv("GEMINI_TIMEOUT", "45"))
 
+# Static per-provider headers (the session is shared across hosts, so keys
+# are not stored on _SESSION.headers)
+_JSON_HEADERS = {"Content-Type": "application/json"}
+_OPENROUTER_HEADERS = {
+    k: {
+        "Authorization": f"Bearer {k}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://example.com",
+        "X-Title": "telegram-bot",
+    }
+    for k in OPENROUTER_KEYS
+}
+_EDENAI_HEADERS = {
+    "Authorization": f"Bearer {EDENAI_KEY}",
+    "Content-Type": "application/json",
+}
+_DEEPSEEK_HEADERS = {
+    "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
+    "Content-Type": "application/json",
+}
+
+
+# --- Pre-serialized request bodies ---
+
+def _dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(data: bytes):
+    # Parse raw response bytes (skips requests' charset detection + decode)
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Request bodies are serialized once with a placeholder; per call only the
+# prompt is encoded and spliced in (sent as data=, skipping requests' json=).
+_PROMPT_SLOT = "__PROMPT__"
+_PROMPT_SLOT_JSON = _dumps(_PROMPT_SLOT)
+
+
+def _render(template: bytes, prompt: str) -> bytes:
+    return template.replace(_PROMPT_SLOT_JSON, _dumps(prompt), 1)
+
+
+_GEMINI_TEMPLATE = _dumps({
+    "contents": [{"parts": [{"text": _PROMPT_SLOT}]}],
+    "generationConfig": {
+        "temperature": GEMINI_TEMPERATURE,
+        "maxOutputTokens": GEMINI_MAX_TOKENS,
+    },
+})
+
+_OPENROUTER_TEMPLATE = _dumps({
+    "model": OPENROUTER_MODEL,
+    "messages": [{"role": "user", "content": _PROMPT_SLOT}],
+    "temperature": OPENROUTER_TEMPERATURE,
+    "max_tokens": OPENROUTER_MAX_TOKENS,
+})
+
+_EDENAI_TEMPLATE = _dumps({
+    "providers": EDENAI_PROVIDER,
+    "text": _PROMPT_SLOT,
+    "model": EDENAI_MODEL,
+    "temperature": EDENAI_TEMPERATURE,
+    "max_tokens": EDENAI_MAX_TOKENS,
+    "chat_history": [],
+    "response_as_dict": True,
+    "attributes_as_list": False,
+    "show_original_response": False,
+})
+
+_DEEPSEEK_TEMPLATE = _dumps({
+    "model": DEEPSEEK_MODEL,
+    "messages": [{"role": "user", "content": _PROMPT_SLOT}],
+    "temperature": DEEPSEEK_TEMPERATURE,
+    "max_tokens": DEEPSEEK_MAX_TOKENS,
+    # Advanced params are read from env but not required here:
+    # "top_p": DEEPSEEK_TOP_P,
+    # "presence_penalty": DEEPSEEK_PRESENCE_PENALTY,
+    # "frequency_penalty": DEEPSEEK_FREQUENCY_PENALTY,
+})
+
+
+# --- Exact-match response cache ---
+
+# Successful replies are cached per (providers, models, params, prompt) for
+# RESPONSE_CACHE_TTL seconds; 0 disables the cache.
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "900"))
+RESPONSE_CACHE_MAX = 512
+
+_RESP_CACHE: OrderedDict[str, tuple[float, str]] = OrderedDict()
+_RESP_CACHE_LOCK = threading.Lock()  # ask_ai runs in worker threads
+_WS_RE = re.compile(r"\s+")
+
+
+def _normalize_prompt(prompt: str) -> str:
+    return _WS_RE.sub(" ", prompt).strip().lower()
+
+
+def _cache_key(prompt: str, model, temperature, max_tokens) -> str:
+    raw = (
+        f"{','.join(ORDER)}|{GEMINI_MODEL}|{OPENROUTER_MODEL}|"
+        f"{model}|{temperature}|{max_tokens}|{_normalize_prompt(prompt)}"
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _cache_get(key: str) -> str | None:
+    with _RESP_CACHE_LOCK:
+        hit = _RESP_CACHE.get(key)
+        if not hit:
+            return None
+        ts, res = hit
+        if _now() - ts >= RESPONSE_CACHE_TTL:
+            del _RESP_CACHE[key]
+            return None
+        _RESP_CACHE.move_to_end(key)
+        return res
 
-# --- Provider implementations ---
 
-def _call_gemini(prompt: str) -> str | None:
+def _cache_put(key: str, res: str):
+    with _RESP_CACHE_LOCK:
+        _RESP_CACHE[key] = (_now(), res)
+        _RESP_CACHE.move_to_end(key)
+        while len(_RESP_CACHE) > RESPONSE_CACHE_MAX:
+            _RESP_CACHE.popitem(last=False)
+
+
+# --- Provider implementations ---
+#
+# Each provider is split into _prepare_* (pick a key, build the request) and
+# _handle_* (interpret status + body), so the same logic serves the blocking
+# requests path (_call_provider) and the async httpx path (_acall_provider).
+# _prepare_* returns (url, body, headers, timeout, key), or None when the
+# provider has no usable key right now.
+
+def _prepare_gemini(prompt: str, model=None, temperature=None, max_tokens=None):
     if not GEMINI_KEYS:
         return None
 
-    candidates = [k for k in GEMINI_KEYS if not _is_cooling(f"gemini:{k}")]
-    if not candidates:
+    _refresh_cooldowns()
+    active = _ACTIVE["gemini"]
+    if not active:
         return None
 
-    key = random.choice(candidates)
+    key = random.choice(tuple(active))
 
     url = f"{GEMINI_API_BASE}/v1/models/{GEMINI_MODEL}:generateContent?key={key}"
-    payload = {
-        "contents": [{"parts": [{"text": prompt}]}],
-        "generationConfig": {
-            "temperature": GEMINI_TEMPERATURE,
-            "maxOutputTokens": GEMINI_MAX_TOKENS,
-        },
-    }
-
-    try:
-        r = requests.post(url, json=payload, timeout=GEMINI_TIMEOUT)
-        _dbg("GEMINI", r.status_code, r.text[:300])
-
-        if r.status_code == 200:
-            j = r.json()
-
-            txt = None
-            try:
-                cands = j.get("candidates", [])
-                if cands:
-                    content = cands[0].get("content")
-                    if isinstance(content, dict):
-                        for p in content.get("parts") or []:
-                            if p.get("text"):
-                                txt = p["text"]
-                                break
-                    elif isinstance(content, list):
-                        for p in content:
-                            if isinstance(p, dict) and p.get("text"):
-                                txt = p["text"]
-                                break
-            except Exception as e:
-                _dbg("GEMINI PARSE_EXC", repr(e))
-
-            if txt:
-                return txt
-
-            # 200 OK but no text – treat as a soft failure and return a neutral message
-            _dbg("GEMINI NO_TEXT", j)
-            return (
-                "The model responded without any usable text.\n"
-                "You can try sending your message again or rephrasing it."
-            )
-
-        # Authentication / quota / rate limit → cool down this key
-        if r.status_code in (401, 403, 429):
-            _mark_bad(f"gemini:{key}")
-            return None
-
-        # Other HTTP errors (e.g. 5xx)
+    body = _render(_GEMINI_TEMPLATE, prompt)
+    return url, body, _JSON_HEADERS, GEMINI_TIMEOUT, key
+
+
+def _handle_gemini(status: int, content: bytes, key: str) -> str | None:
+    if status == 200:
+        j = _loads(content)
+
+        txt = None
+        try:
+            cands = j.get("candidates", [])
+            if cands:
+                content = cands[0].get("content")
+                if isinstance(content, dict):
+                    for p in content.get("parts") or []:
+                        if p.get("text"):
+                            txt = p["text"]
+                            break
+                elif isinstance(content, list):
+                    for p in content:
+                        if isinstance(p, dict) and p.get("text"):
+                            txt = p["text"]
+                            break
+        except Exception as e:
+            _dbg("GEMINI PARSE_EXC", repr(e))
+
+        if txt:
+            return txt
+
+        # 200 OK but no text (e.g. safety block) – transient failure, so the
+        # next provider is tried and nothing is cached or made sticky
+        _dbg("GEMINI NO_TEXT", j)
         return "__TEMP_FAIL__"
 
-    except Exception as e:
-        _dbg("GEMINI EXC", repr(e))
-        return "__TEMP_FAIL__"
+    # Authentication / quota / rate limit → cool down this key
+    if status in (401, 403, 429):
+        _mark_bad(f"gemini:{key}")
+        return None
+
+    # Other HTTP errors (e.g. 5xx)
+    return "__TEMP_FAIL__"
 
 
-def _call_openrouter(prompt: str) -> str | None:
+def _prepare_openrouter(
+    prompt: str,
+    model: str | None = None,
+    temperature: float | None = None,
+    max_tokens: int | None = None,
+):
     if not OPENROUTER_KEYS:
         return None
 
-    candidates = [k for k in OPENROUTER_KEYS if not _is_cooling(f"openrouter:{k}")]
-    if not candidates:
+    _refresh_cooldowns()
+    active = _ACTIVE["openrouter"]
+    if not active:
         return None
 
-    key = random.choice(candidates)
+    key = random.choice(tuple(active))
 
     url = "https://openrouter.ai/api/v1/chat/completions"
-    payload = {
-        "model": OPENROUTER_MODEL,
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": OPENROUTER_TEMPERATURE,
-        "max_tokens": OPENROUTER_MAX_TOKENS,
-    }
-    headers = {
-        "Authorization": f"Bearer {key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://example.com",
-        "X-Title": "telegram-bot",
-    }
-
-    try:
-        r = requests.post(url, json=payload, headers=headers, timeout=45)
-        _dbg("OPENROUTER", r.status_code, r.text[:300])
-
-        if r.status_code == 200:
-            j = r.json()
-            return j["choices"][0]["message"]["content"]
-
-        if r.status_code in (401, 403, 429):
-            _mark_bad(f"openrouter:{key}")
-            return None
-
-        return "__TEMP_FAIL__"
+    if model is None and temperature is None and max_tokens is None:
+        body = _render(_OPENROUTER_TEMPLATE, prompt)
+    else:
+        body = _dumps({
+            "model": model or OPENROUTER_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": OPENROUTER_TEMPERATURE if temperature is None else temperature,
+            "max_tokens": OPENROUTER_MAX_TOKENS if max_tokens is None else max_tokens,
+        })
+    return url, body, _OPENROUTER_HEADERS[key], 45, key
+
+
+def _handle_openrouter(status: int, content: bytes, key: str) -> str | None:
+    if status == 200:
+        j = _loads(content)
+        return j["choices"][0]["message"]["content"]
+
+    if status in (401, 403, 429):
+        _mark_bad(f"openrouter:{key}")
+        return None
 
-    except Exception as e:
-        _dbg("OPENROUTER EXC", repr(e))
-        return "__TEMP_FAIL__"
+    return "__TEMP_FAIL__"
 
 
-def _call_edenai(prompt: str) -> str | None:
+def _prepare_edenai(prompt: str, model=None, temperature=None, max_tokens=None):
     if not EDENAI_KEY:
         return None
 
@@ -248,39 +533,23 @@ def _call_edenai(prompt: str) -> str | None:
         return None
 
     url = "https://api.edenai.run/v2/text/chat"
-    headers = {"Authorization": f"Bearer {EDENAI_KEY}"}
-    payload = {
-        "providers": EDENAI_PROVIDER,
-        "text": prompt,
-        "model": EDENAI_MODEL,
-        "temperature": EDENAI_TEMPERATURE,
-        "max_tokens": EDENAI_MAX_TOKENS,
-        "chat_history": [],
-        "response_as_dict": True,
-        "attributes_as_list": False,
-        "show_original_response": False,
-    }
-
-    try:
-        r = requests.post(url, json=payload, headers=headers, timeout=45)
-        _dbg("EDENAI", r.status_code, r.text[:300])
+    body = _render(_EDENAI_TEMPLATE, prompt)
+    return url, body, _EDENAI_HEADERS, 45, "edenai"
 
-        if r.status_code == 200:
-            j = r.json()
-            return j.get(EDENAI_PROVIDER, {}).get("generated_text")
 
-        if r.status_code in (401, 403, 429):
-            _mark_bad("edenai")
-            return None
+def _handle_edenai(status: int, content: bytes, key: str) -> str | None:
+    if status == 200:
+        j = _loads(content)
+        return j.get(EDENAI_PROVIDER, {}).get("generated_text")
 
-        return "__TEMP_FAIL__"
+    if status in (401, 403, 429):
+        _mark_bad("edenai")
+        return None
 
-    except Exception as e:
-        _dbg("EDENAI EXC", repr(e))
-        return "__TEMP_FAIL__"
+    return "__TEMP_FAIL__"
 
 
-def _call_deepseek(prompt: str) -> str | None:
+def _prepare_deepseek(prompt: str, model=None, temperature=None, max_tokens=None):
     if not DEEPSEEK_API_KEY:
         return None
 
@@ -288,51 +557,473 @@ def _call_deepseek(prompt: str) -> str | None:
         return None
 
     url = "https://api.deepseek.com/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "model": DEEPSEEK_MODEL,
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": DEEPSEEK_TEMPERATURE,
-        "max_tokens": DEEPSEEK_MAX_TOKENS,
-        # Advanced params are read from env but not required here:
-        # "top_p": DEEPSEEK_TOP_P,
-        # "presence_penalty": DEEPSEEK_PRESENCE_PENALTY,
-        # "frequency_penalty": DEEPSEEK_FREQUENCY_PENALTY,
-    }
+    body = _render(_DEEPSEEK_TEMPLATE, prompt)
+    return url, body, _DEEPSEEK_HEADERS, 45, "deepseek"
+
+
+def _handle_deepseek(status: int, content: bytes, key: str) -> str | None:
+    if status == 200:
+        try:
+            j = _loads(content)
+            return j["choices"][0]["message"]["content"]
+        except Exception as e:
+            _dbg("DEEPSEEK NO_TEXT", repr(e))
+            return "__TEMP_FAIL__"
+
+    # 401 / 403 / 429 / 402 (e.g. insufficient credit) → cool down temporarily
+    if status in (401, 403, 429, 402):
+        _mark_bad("deepseek")
+        return None
+
+    return "__TEMP_FAIL__"
+
+
+# --- Streaming (server-sent events) ---
+
+def _with_stream(template: bytes) -> bytes:
+    # Templates are compact JSON objects: splice the flag in before the final "}"
+    return template[:-1] + b',"stream":true}'
+
+
+_STREAMABLE = frozenset(("gemini", "openrouter", "deepseek"))
+
+_OPENROUTER_STREAM_TEMPLATE = _with_stream(_OPENROUTER_TEMPLATE)
+_DEEPSEEK_STREAM_TEMPLATE = _with_stream(_DEEPSEEK_TEMPLATE)
+
+
+def _gemini_delta(j: dict) -> str:
+    cands = j.get("candidates") or []
+    if not cands:
+        return ""
+    content = cands[0].get("content") or {}
+    return "".join(p.get("text", "") for p in content.get("parts") or [])
+
+
+def _openai_delta(j: dict) -> str:
+    choices = j.get("choices") or []
+    if not choices:
+        return ""
+    return (choices[0].get("delta") or {}).get("content") or ""
+
+
+def _pick_stream_key(provider: str):
+    """
+    Returns (key, cooldown_name) for a streaming request, or None when the
+    provider has no usable key right now.
+    """
+    if provider in ("gemini", "openrouter"):
+        keys = GEMINI_KEYS if provider == "gemini" else OPENROUTER_KEYS
+        if not keys:
+            return None
+        _refresh_cooldowns()
+        active = _ACTIVE[provider]
+        if not active:
+            return None
+        key = random.choice(tuple(active))
+        bad = f"{provider}:{key}"
+    elif provider == "deepseek":
+        if not DEEPSEEK_API_KEY or _is_cooling("deepseek"):
+            return None
+        key = DEEPSEEK_API_KEY
+        bad = "deepseek"
+    else:
+        return None
+
+    return key, bad
+
+
+def _stream_provider(
+    provider: str,
+    prompt: str,
+    model: str | None = None,
+    temperature: float | None = None,
+    max_tokens: int | None = None,
+):
+    """
+    Generator over reply text chunks from one provider.
+
+    The first item is a status: True once the stream is open, otherwise the
+    same None / "__TEMP_FAIL__" sentinel the _call_* functions return (and
+    nothing else is yielded). If the stream breaks midway (connection error,
+    malformed frame) a final False follows the text received so far.
+    """
+    picked = _pick_stream_key(provider)
+    if picked is None:
+        yield None
+        return
+    key, bad = picked
+
+    if provider == "gemini":
+        url = (
+            f"{GEMINI_API_BASE}/v1/models/{GEMINI_MODEL}"
+            f":streamGenerateContent?alt=sse&key={key}"
+        )
+        body = _render(_GEMINI_TEMPLATE, prompt)
+        headers, timeout, delta = _JSON_HEADERS, GEMINI_TIMEOUT, _gemini_delta
+        bad_statuses = (401, 403, 429)
+    elif provider == "openrouter":
+        url = "https://openrouter.ai/api/v1/chat/completions"
+        if model is None and temperature is None and max_tokens is None:
+            body = _render(_OPENROUTER_STREAM_TEMPLATE, prompt)
+        else:
+            body = _dumps({
+                "model": model or OPENROUTER_MODEL,
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": OPENROUTER_TEMPERATURE if temperature is None else temperature,
+                "max_tokens": OPENROUTER_MAX_TOKENS if max_tokens is None else max_tokens,
+                "stream": True,
+            })
+        headers, timeout, delta = _OPENROUTER_HEADERS[key], 45, _openai_delta
+        bad_statuses = (401, 403, 429)
+    else:
+        url = "https://api.deepseek.com/v1/chat/completions"
+        body = _render(_DEEPSEEK_STREAM_TEMPLATE, prompt)
+        headers, timeout, delta = _DEEPSEEK_HEADERS, 45, _openai_delta
+        bad_statuses = (401, 403, 429, 402)
 
     try:
-        r = requests.post(url, json=payload, headers=headers, timeout=45)
-        _dbg("DEEPSEEK", r.status_code, r.text[:300])
+        r = _SESSION.post(url, data=body, headers=headers, timeout=timeout, stream=True)
+    except Exception as e:
+        _dbg(provider.upper(), "STREAM EXC", repr(e))
+        yield "__TEMP_FAIL__"
+        return
+
+    with r:
+        _dbg(provider.upper(), "STREAM", r.status_code)
+        if r.status_code != 200:
+            if r.status_code in bad_statuses:
+                _mark_bad(bad)
+                yield None
+            else:
+                yield "__TEMP_FAIL__"
+            return
+
+        yield True
+
+        try:
+            for line in r.iter_lines():
+                # SSE frames: "data: {...}"; comments / keep-alives are skipped
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                text = delta(_loads(data))
+                if text:
+                    yield text
+        except Exception as e:
+            # Mid-stream failure: what was delivered stays, but the caller
+            # must not treat it as a complete reply
+            _dbg(provider.upper(), "STREAM EXC", repr(e))
+            yield False
+
+
+def ask_ai_stream(
+    prompt: str,
+    *,
+    model: str | None = None,
+    temperature: float | None = None,
+    max_tokens: int | None = None,
+    semantic_key: str | None = None,
+):
+    """
+    Generator variant of ask_ai() yielding the reply in chunks as they arrive.
+
+    - Gemini / OpenRouter / Deepseek are streamed; other providers (and cache
+      hits) yield the whole reply at once.
+    - Failover to the next provider only happens before the first chunk; a
+      stream that breaks midway ends with what was received so far, counts as
+      a transient failure and is not cached.
+    """
+    cached, cache_key, sem_cache = _cache_lookup(
+        prompt, model, temperature, max_tokens, semantic_key
+    )
+    if cached is not None:
+        yield cached
+        return
 
-        if r.status_code == 200:
+    had_temp_fail = False
+
+    for p in _provider_order():
+        if p not in _STREAMABLE:
+            res = _call_provider(p, prompt, model, temperature, max_tokens)
+        else:
+            chunks = _stream_provider(p, prompt, model, temperature, max_tokens)
             try:
-                j = r.json()
-                return j["choices"][0]["message"]["content"]
-            except Exception as e:
-                _dbg("DEEPSEEK NO_TEXT", repr(e))
-                return "__TEMP_FAIL__"
-
-        # 401 / 403 / 429 / 402 (e.g. insufficient credit) → cool down temporarily
-        if r.status_code in (401, 403, 429, 402):
-            _mark_bad("deepseek")
+                status = next(chunks)
+                if status is not True:
+                    res = status
+                else:
+                    received = []
+                    aborted = False
+                    for chunk in chunks:
+                        if chunk is False:
+                            aborted = True
+                            break
+                        received.append(chunk)
+                        yield chunk
+                    res = "".join(received)
+                    if received:
+                        if aborted:
+                            _note_result(p, "__TEMP_FAIL__")
+                        elif _note_result(p, res):
+                            _cache_store(cache_key, sem_cache, semantic_key, res)
+                        return
+                    res = "__TEMP_FAIL__"
+            finally:
+                # Also runs when our consumer closes us: releases the response
+                chunks.close()
+
+        if res == "__TEMP_FAIL__":
+            had_temp_fail = True
+        if _note_result(p, res):
+            _cache_store(cache_key, sem_cache, semantic_key, res)
+            yield res
+            return
+
+    # All providers failed
+    yield _all_failed_reply(had_temp_fail)
+
+
+async def ask_ai_stream_async(prompt: str, **kwargs):
+    """
+    Async iterator over ask_ai_stream(); the blocking stream is consumed in a
+    worker thread and chunks are handed to the event loop as they arrive.
+
+    If the consumer stops early, the worker closes the stream (and its HTTP
+    response) when the next chunk arrives instead of reading it to the end.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    end = object()
+    stop = threading.Event()
+
+    def pump():
+        stream = ask_ai_stream(prompt, **kwargs)
+        try:
+            for chunk in stream:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, chunk)
+        finally:
+            stream.close()
+            loop.call_soon_threadsafe(queue.put_nowait, end)
+
+    worker = asyncio.ensure_future(asyncio.to_thread(pump))
+    finished = False
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is end:
+                break
+            yield chunk
+        finished = True
+    finally:
+        stop.set()
+        if not finished:
+            # Don't wait for the thread; just make sure its error is retrieved
+            worker.add_done_callback(lambda f: f.cancelled() or f.exception())
+    await worker
+
+
+# --- Unified entrypoint ---
+
+def _provider_order() -> tuple[str, ...]:
+    """
+    Providers in ORDER, with the recent successful one moved to the front
+    while it is within the sticky window.
+    """
+    if (
+        _LAST_PROVIDER
+        and (_now() - _LAST_PROVIDER_TS) < PROVIDER_STICKY_SEC
+        and _LAST_PROVIDER in _PROVIDERS_ORDER
+    ):
+        return (_LAST_PROVIDER,) + tuple(
+            p for p in _PROVIDERS_ORDER if p != _LAST_PROVIDER
+        )
+    return _PROVIDERS_ORDER
+
+
+_DISPATCH = {
+    "gemini": (_prepare_gemini, _handle_gemini),
+    "openrouter": (_prepare_openrouter, _handle_openrouter),
+    "edenai": (_prepare_edenai, _handle_edenai),
+    "deepseek": (_prepare_deepseek, _handle_deepseek),
+}
+
+
+def _call_provider(
+    p: str,
+    prompt: str,
+    model: str | None = None,
+    temperature: float | None = None,
+    max_tokens: int | None = None,
+) -> str | None:
+    """
+    Blocking call to one provider over the shared requests session.
+    Returns the reply, None (hard failure) or "__TEMP_FAIL__".
+    """
+    spec = _DISPATCH.get(p)
+    if spec is None:
+        return None
+    prepare, handle = spec
+
+    try:
+        req = prepare(prompt, model, temperature, max_tokens)
+        if req is None:
             return None
+        url, body, headers, timeout, key = req
+
+        r = _SESSION.post(url, data=body, headers=headers, timeout=timeout)
+        if DEBUG_MODE:  # r.text decodes the whole body
+            _dbg(p.upper(), r.status_code, r.text[:300])
+        return handle(r.status_code, r.content, key)
 
+    except Exception as e:
+        _dbg(p.upper(), "EXC", repr(e))
         return "__TEMP_FAIL__"
 
+
+async def _acall_provider(
+    p: str,
+    prompt: str,
+    model: str | None = None,
+    temperature: float | None = None,
+    max_tokens: int | None = None,
+) -> str | None:
+    """
+    Async counterpart of _call_provider() over the shared httpx client.
+    """
+    spec = _DISPATCH.get(p)
+    if spec is None:
+        return None
+    prepare, handle = spec
+
+    try:
+        req = prepare(prompt, model, temperature, max_tokens)
+        if req is None:
+            return None
+        url, body, headers, timeout, key = req
+
+        # A per-request timeout replaces the client default entirely, so keep
+        # the short connect timeout explicitly
+        r = await _http_client().post(
+            url, content=body, headers=headers, timeout=httpx.Timeout(timeout, connect=5.0)
+        )
+        if DEBUG_MODE:
+            _dbg(p.upper(), r.http_version, r.status_code, r.text[:300])
+        return handle(r.status_code, r.content, key)
+
     except Exception as e:
-        _dbg("DEEPSEEK EXC", repr(e))
+        _dbg(p.upper(), "EXC", repr(e))
         return "__TEMP_FAIL__"
 
 
-# --- Unified entrypoint ---
+def _note_result(p: str, res: str | None) -> bool:
+    """
+    Update sticky / failure bookkeeping for one provider result.
+    Returns True when res is a usable reply.
+    """
+    global _LAST_PROVIDER, _LAST_PROVIDER_TS
+
+    # Transient error: keep track but continue to next provider
+    if res == "__TEMP_FAIL__":
+        _FAIL_COUNTS[p] = _FAIL_COUNTS.get(p, 0) + 1
 
-def ask_ai(prompt: str) -> str:
+        if _FAIL_COUNTS[p] >= PROVIDER_FAILS_BEFORE_SWITCH:
+            if _LAST_PROVIDER == p:
+                _LAST_PROVIDER = None
+        return False
+
+    # Hard failure: auth / quota / configuration
+    if res is None:
+        _FAIL_COUNTS[p] = 0
+        if _LAST_PROVIDER == p:
+            _LAST_PROVIDER = None
+        return False
+
+    # Successful response
+    if isinstance(res, str) and res.strip():
+        _FAIL_COUNTS[p] = 0
+        _LAST_PROVIDER = p
+        _LAST_PROVIDER_TS = _now()
+        return True
+
+    # Any other unexpected case – try next provider
+    return False
+
+
+def _cache_lookup(
+    prompt: str,
+    model: str | None,
+    temperature: float | None,
+    max_tokens: int | None,
+    semantic_key: str | None,
+):
+    """
+    Returns (cached_reply_or_None, exact_cache_key, semantic_cache).
+    """
+    cache_key = None
+    if RESPONSE_CACHE_TTL > 0:
+        cache_key = _cache_key(prompt, model, temperature, max_tokens)
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            _dbg("CACHE HIT", cache_key[:12])
+            return cached, cache_key, None
+
+    sem_cache = semantic_cache.get_cache() if semantic_key else None
+    if sem_cache is not None:
+        try:
+            cached = sem_cache.check(semantic_key)
+        except Exception as e:
+            _dbg("SEMANTIC CACHE EXC", repr(e))
+            cached = None
+        if cached is not None:
+            _dbg("SEMANTIC CACHE HIT")
+            return cached, cache_key, sem_cache
+
+    return None, cache_key, sem_cache
+
+
+def _cache_store(cache_key: str | None, sem_cache, semantic_key: str | None, res: str):
+    if cache_key is not None:
+        _cache_put(cache_key, res)
+    if sem_cache is not None:
+        try:
+            sem_cache.store(semantic_key, res)
+        except Exception as e:
+            _dbg("SEMANTIC CACHE EXC", repr(e))
+
+
+def _all_failed_reply(had_temp_fail: bool) -> str:
+    if had_temp_fail:
+        # CUSTOMIZE: end-user message for temporary connectivity issues
+        return (
+            "I’m having trouble reaching the language model services right now.\n"
+            "This is likely a temporary issue—please try again in a moment."
+        )
+    else:
+        # CUSTOMIZE: end-user message for configuration / key problems
+        return (
+            "No language model providers are currently available.\n"
+            "Please check your API keys, quotas, and configuration."
+        )
+
+
+def ask_ai(
+    prompt: str,
+    *,
+    model: str | None = None,
+    temperature: float | None = None,
+    max_tokens: int | None = None,
+    semantic_key: str | None = None,
+) -> str:
     """
     Synchronous dispatcher over all configured providers.
 
+    model / temperature / max_tokens override the OpenRouter settings for this
+    call only (module globals are left untouched); other providers ignore them.
+
     Behaviour:
     - Tries providers in ORDER (from env).
     - Treats "__TEMP_FAIL__" as a transient failure (5xx / timeout / parse error).
@@ -340,74 +1031,214 @@ def ask_ai(prompt: str) -> str:
     - Recent successful provider is preferred for PROVIDER_STICKY_SEC seconds.
     - If a provider hits PROVIDER_FAILS_BEFORE_SWITCH transient failures in a row,
       it is no longer treated as "sticky".
+    - Successful replies are served from an exact-match cache (whitespace /
+      case-insensitive) for RESPONSE_CACHE_TTL seconds.
+    - If semantic_key (user turn + preceding context) is given and SEMANTIC_CACHE is
+      enabled, a reply to a semantically equivalent turn is reused as well.
     """
-    global _LAST_PROVIDER, _LAST_PROVIDER_TS, _FAIL_COUNTS
+    cached, cache_key, sem_cache = _cache_lookup(
+        prompt, model, temperature, max_tokens, semantic_key
+    )
+    if cached is not None:
+        return cached
 
     had_temp_fail = False
 
-    providers_order = [p.strip().lower() for p in ORDER if p.strip()]
-    now = _now()
-
-    # Prefer the most recently successful provider within sticky window
-    if _LAST_PROVIDER and (now - _LAST_PROVIDER_TS) < PROVIDER_STICKY_SEC:
-        if _LAST_PROVIDER in providers_order:
-            providers_order.remove(_LAST_PROVIDER)
-            providers_order.insert(0, _LAST_PROVIDER)
-
-    for provider in providers_order:
-        p = provider.lower()
-
-        if p == "gemini":
-            res = _call_gemini(prompt)
-        elif p == "openrouter":
-            res = _call_openrouter(prompt)
-        elif p == "edenai":
-            res = _call_edenai(prompt)
-        elif p == "deepseek":
-            res = _call_deepseek(prompt)
-        else:
-            res = None
-
-        # Transient error: keep track but continue to next provider
+    for p in _provider_order():
+        res = _call_provider(p, prompt, model, temperature, max_tokens)
         if res == "__TEMP_FAIL__":
             had_temp_fail = True
-            _FAIL_COUNTS[p] = _FAIL_COUNTS.get(p, 0) + 1
+        if _note_result(p, res):
+            _cache_store(cache_key, sem_cache, semantic_key, res)
+            return res
 
-            if _FAIL_COUNTS[p] >= PROVIDER_FAILS_BEFORE_SWITCH:
-                if _LAST_PROVIDER == p:
-                    _LAST_PROVIDER = None
-            continue
+    # All providers failed
+    return _all_failed_reply(had_temp_fail)
 
-        # Hard failure: auth / quota / configuration
-        if res is None:
-            _FAIL_COUNTS[p] = 0
-            if _LAST_PROVIDER == p:
-                _LAST_PROVIDER = None
-            continue
 
-        # Successful response
-        if isinstance(res, str) and res.strip():
-            _FAIL_COUNTS[p] = 0
-            _LAST_PROVIDER = p
-            _LAST_PROVIDER_TS = now
-            return res
+async def _ask_ai_race(
+    prompt: str,
+    *,
+    model: str | None = None,
+    temperature: float | None = None,
+    max_tokens: int | None = None,
+    semantic_key: str | None = None,
+) -> str:
+    """
+    Same contract as ask_ai(), but keeps up to RACE_PROVIDERS providers in
+    flight at once (RACE_PROVIDERS=1 is plain sequential failover). Each
+    failure launches the next provider in order; the first usable reply wins
+    and the remaining tasks are cancelled.
+
+    With the httpx client cancellation aborts the request; on the requests
+    path a cancelled call still finishes in its worker thread and its result
+    is discarded.
+    """
+    cached, cache_key, sem_cache = await asyncio.to_thread(
+        _cache_lookup, prompt, model, temperature, max_tokens, semantic_key
+    )
+    if cached is not None:
+        return cached
+
+    queue = list(_provider_order())
+    running: dict[asyncio.Task, str] = {}
+    had_temp_fail = False
 
-        # Any other unexpected case – try next provider
-        continue
+    def launch():
+        p = queue.pop(0)
+        if _USE_HTTPX:
+            call = _acall_provider(p, prompt, model, temperature, max_tokens)
+        else:
+            call = asyncio.to_thread(_call_provider, p, prompt, model, temperature, max_tokens)
+        task = asyncio.create_task(call)
+        running[task] = p
+
+    try:
+        while queue and len(running) < RACE_PROVIDERS:
+            launch()
+
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                p = running.pop(task)
+                try:
+                    res = task.result()
+                except Exception as e:
+                    _dbg("RACE EXC", p, repr(e))
+                    res = "__TEMP_FAIL__"
+
+                if res == "__TEMP_FAIL__":
+                    had_temp_fail = True
+                if _note_result(p, res):
+                    _dbg("RACE WINNER", p)
+                    await asyncio.to_thread(_cache_store, cache_key, sem_cache, semantic_key, res)
+                    return res
+
+                if queue:
+                    launch()
+    finally:
+        for task in running:
+            task.cancel()
 
     # All providers failed
-    if had_temp_fail:
-        # CUSTOMIZE: end-user message for temporary connectivity issues
-        return (
-            "I’m having trouble reaching the language model services right now.\n"
-            "This is likely a temporary issue—please try again in a moment."
-        )
+    return _all_failed_reply(had_temp_fail)
+
+
+# Identical prompts already being answered: key → future of the reply.
+# Only touched from the event loop, so no lock is needed.
+_INFLIGHT: dict[str, asyncio.Future] = {}
+
+
+async def ask_ai_async(prompt: str, **kwargs) -> str:
+    """
+    Async variant of ask_ai().
+
+    The provider calls use blocking HTTP, so they run in a worker thread and
+    the event loop keeps serving other updates meanwhile (or, with
+    HTTPX_CLIENT=1, go through the shared async httpx client). With
+    RACE_PROVIDERS > 1 several providers are tried concurrently instead of
+    one after another.
+
+    Concurrent calls with the same prompt (same key as the response cache)
+    share a single provider request.
+    """
+    key = _cache_key(
+        prompt, kwargs.get("model"), kwargs.get("temperature"), kwargs.get("max_tokens")
+    )
+    fut = _INFLIGHT.get(key)
+    if fut is not None:
+        _dbg("INFLIGHT JOIN", key[:12])
+        # shield: a cancelled follower must not cancel the shared request
+        return await asyncio.shield(fut)
+
+    fut = asyncio.get_running_loop().create_future()
+    # Mark any exception as retrieved when nobody joined
+    fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _INFLIGHT[key] = fut
+    try:
+        if RACE_PROVIDERS > 1 or _USE_HTTPX:
+            res = await _ask_ai_race(prompt, **kwargs)
+        else:
+            res = await asyncio.to_thread(ask_ai, prompt, **kwargs)
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    except Exception as e:
+        fut.set_exception(e)
+        raise
     else:
-        # CUSTOMIZE: end-user message for configuration / key problems
-        return (
-            "No language model providers are currently available.\n"
-            "Please check your API keys, quotas, and configuration."
-        )
+        fut.set_result(res)
+        return res
+    finally:
+        _INFLIGHT.pop(key, None)
+
+
+# --- Fast path for trivial turns ---
+
+# FASTPATH=1: bare greetings and punctuation / emoji-only pings get a canned
+# reply without calling any provider
+FASTPATH = os.getenv("FASTPATH", "0").lower() in ("1", "true", "yes", "on")
+
+_FASTPATH_GREETING_RE = re.compile(r"^(hi|hey|yo|hello|嗨|你好|喂)[\s!?.。！？~]*$", re.I)
+_FASTPATH_PING_RE = re.compile(r"^[\W_]{1,3}$")  # "?", "!!", "👍" ...
+
+# Chinese greetings / full-width punctuation get a reply from the Chinese pool
+_FASTPATH_CJK_RE = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+# CUSTOMIZE: canned replies; keep them in your character's voice
+FASTPATH_REPLIES = (
+    "Hey! 😊 What's up?",
+    "Hi hi~ How's your day going?",
+    "I'm here! What's on your mind?",
+)
+FASTPATH_REPLIES_ZH = (
+    "嗨嗨～😊 怎麼啦？",
+    "我在喔！今天過得怎麼樣？",
+    "哈囉～想聊點什麼呢？",
+)
+
+
+def _fastpath_reply(text: str) -> str | None:
+    text = text.strip()
+    if _FASTPATH_GREETING_RE.match(text) or _FASTPATH_PING_RE.match(text):
+        pool = FASTPATH_REPLIES_ZH if _FASTPATH_CJK_RE.search(text) else FASTPATH_REPLIES
+        return random.choice(pool)
+    return None
+
+
+# --- Prompt token budget ---
+
+# CUSTOMIZE: input budget per request; 0 disables token trimming
+MAX_INPUT_TOKENS = int(os.getenv("MAX_INPUT_TOKENS", "3500"))
+
+try:
+    import tiktoken  # optional: exact token counts
+    _ENC = tiktoken.get_encoding("cl100k_base")
+except Exception:  # not installed, or the BPE file cannot be fetched
+    _ENC = None
+
+
+def _count_tokens(text: str) -> int:
+    if _ENC is not None:
+        return len(_ENC.encode(text))
+    return len(text) // 4  # rough average for English / mixed text
+
+
+def _tail_tokens(text: str, budget: int) -> tuple[str, int]:
+    """
+    Keep the end of text within budget tokens.
+    Returns (trimmed_text, token_count).
+    """
+    if budget <= 0 or not text:
+        return "", 0
+    if _ENC is not None:
+        ids = _ENC.encode(text)
+        if len(ids) <= budget:
+            return text, len(ids)
+        return _ENC.decode(ids[-budget:]), budget
+    if len(text) // 4 <= budget:
+        return text, len(text) // 4
+    return text[-budget * 4:], budget
 
 
 # --- Async wrapper for bot.py ---
@@ -419,7 +1250,7 @@ class LLMProvider:
     Responsibilities:
     - Merge system messages into a single user-facing prompt string.
     - Attach recent chat context and long-term memory summaries.
-    - Delegate to ask_ai().
+    - Delegate to ask_ai_async() (or ask_ai_stream_async() for chat_stream()).
     """
 
     def __init__(self):
@@ -428,30 +1259,74 @@ class LLMProvider:
         # Max number of characters of long-term memory to inject each time
         self.long_mem_chars = int(os.getenv("LONG_MEMORY_CHARS", "1500"))
 
-    async def chat(self, messages: list[dict]) -> str:
-        # 1) Merge the message contents into a single string
-        parts = [m["content"] for m in messages if m.get("content")]
-        user_prompt = "\n".join(parts)
-
-        # 2) Short-term context: recent chat for today
-        recent_chat = read_recent_chat(self.chat_today_path, max_chars=2000, max_lines=50)
-        recent_block = ""
-        if recent_chat:
-            recent_block = (
-                "RECENT_CHAT_CONTEXT (do not repeat verbatim; use for continuity):\n"
-                f"{recent_chat}\n\n"
-            )
-
-        # 3) Long-term memory: summaries across days
-        long_mem = load_memory()
-        long_block = ""
+    async def _build_prompt(self, messages: list[dict]) -> str:
+        """
+        Returns the final prompt for the given messages.
+        """
+        # 1) Current turn: the non-empty message contents, joined at the end
+        contents = [m["content"] for m in messages if m.get("content")]
+
+        # 2) Short-term context (recent chat for today) and 3) long-term memory
+        # (summaries across days) are independent file reads: run them together
+        recent_chat, long_mem = await asyncio.gather(
+            asyncio.to_thread(read_recent_chat, self.chat_today_path, 2000, 50),
+            asyncio.to_thread(load_memory),
+        )
+        long_mem = long_mem[-self.long_mem_chars:]
+
+        # Token budget: the current turn is always kept whole, then recent
+        # chat, then long-term memory get what is left (newest text first)
+        if MAX_INPUT_TOKENS > 0:
+            budget = MAX_INPUT_TOKENS - sum(_count_tokens(c) for c in contents)
+            recent_chat, used = _tail_tokens(recent_chat, budget)
+            long_mem, _ = _tail_tokens(long_mem, budget - used)
+
+        # 4) Final prompt: long-term → short-term → current turn, built with
+        # a single join instead of intermediate multi-KB strings
+        chunks: list[str] = []
+        a = chunks.append
         if long_mem:
-            long_block = (
-                "LONG_TERM_MEMORY (high-level summaries; apply gently, not verbatim):\n"
-                f"{long_mem[-self.long_mem_chars:]}\n\n"
-            )
-
-        # 4) Final prompt: long-term → short-term → current turn
-        final_prompt = f"{long_block}{recent_block}{user_prompt}"
-
-        return ask_ai(final_prompt)
\ No newline at end of file
+            a("LONG_TERM_MEMORY (high-level summaries; apply gently, not verbatim):\n")
+            a(long_mem)
+            a("\n\n")
+        if recent_chat:
+            a("RECENT_CHAT_CONTEXT (do not repeat verbatim; use for continuity):\n")
+            a(recent_chat)
+            a("\n\n")
+        for i, c in enumerate(contents):
+            if i:
+                a("\n")
+            a(c)
+        final_prompt = "".join(chunks)
+
+        return final_prompt
+
+    def _fastpath(self, messages: list[dict]) -> str | None:
+        if not FASTPATH or not messages or messages[-1].get("role") != "user":
+            return None
+        return _fastpath_reply(messages[-1].get("content") or "")
+
+    async def chat(self, messages: list[dict], semantic_key: str | None = None) -> str:
+        """
+        semantic_key opts the turn into the semantic cache (see
+        semantic_cache.make_key); leave it None for synthetic prompts.
+        """
+        canned = self._fastpath(messages)
+        if canned is not None:
+            return canned
+
+        final_prompt = await self._build_prompt(messages)
+        return await ask_ai_async(final_prompt, semantic_key=semantic_key)
+
+    async def chat_stream(self, messages: list[dict], semantic_key: str | None = None):
+        """
+        Like chat(), but yields the reply in chunks as the provider streams it.
+        """
+        canned = self._fastpath(messages)
+        if canned is not None:
+            yield canned
+            return
+
+        final_prompt = await self._build_prompt(messages)
+        async for chunk in ask_ai_stream_async(final_prompt, semantic_key=semantic_key):
+            yield chunk
@@ -0,0 +1,141 @@
+"""
+Optional semantic response cache for ask_ai().
+
+- Enabled with SEMANTIC_CACHE=1 (off by default)
+- Embeds the current user turn (plus the preceding chat line) with a small
+  local sentence-transformers model; only real user messages are cached
+- Keeps an in-process FAISS inner-product index over L2-normalized embeddings
+- Returns a stored reply when a cached turn is within SEMANTIC_CACHE_DISTANCE
+  (cosine distance) and younger than SEMANTIC_CACHE_TTL seconds
+- Requires sentence-transformers, faiss and numpy; if any is missing the cache
+  silently stays disabled
+"""
+
+import os
+import time
+import threading
+
+# Keep debug behaviour aligned with providers.py
+DEBUG_MODE = os.getenv("DEBUG_MODE", "false").lower() in ("1", "true", "yes", "on")
+
+
+def _dbg(*args):
+    """
+    Debug print for this module. No output when DEBUG_MODE is false.
+    """
+    if DEBUG_MODE:
+        print("[DBG][SEMCACHE]", *args)
+
+
+# --- Configuration (from environment) ---
+
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "0").lower() in ("1", "true", "yes", "on")
+SEMANTIC_CACHE_MODEL = os.getenv(
+    "SEMANTIC_CACHE_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
+)
+SEMANTIC_CACHE_DISTANCE = float(os.getenv("SEMANTIC_CACHE_DISTANCE", "0.12"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "900"))
+SEMANTIC_CACHE_MAX = 2048
+# Shorter turns ("ok", "why?", "嗯嗯") depend on context too much to reuse replies
+SEMANTIC_CACHE_MIN_CHARS = int(os.getenv("SEMANTIC_CACHE_MIN_CHARS", "8"))
+
+
+def make_key(user_text: str, previous_line: str = "") -> str | None:
+    """
+    Cache key text for a real user turn: the preceding chat line plus the
+    turn itself, so a reply is only reused within a similar exchange.
+    None when the cache is off or the turn is too short to match safely.
+    """
+    user_text = user_text.strip()
+    if not SEMANTIC_CACHE or len(user_text) < SEMANTIC_CACHE_MIN_CHARS:
+        return None
+    return f"{previous_line.strip()}\n{user_text}"
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour cache of (user turn embedding → reply).
+
+    Entries are kept in insertion order; the oldest one is evicted once
+    SEMANTIC_CACHE_MAX is exceeded.
+    """
+
+    def __init__(self, model_name: str, distance_threshold: float, ttl: int, max_entries: int):
+        import faiss
+        import numpy as np
+        from sentence_transformers import SentenceTransformer
+
+        self._np = np
+        self._model = SentenceTransformer(model_name)
+        self._index = faiss.IndexFlatIP(self._model.get_sentence_embedding_dimension())
+        self._responses: list[str] = []
+        self._timestamps: list[float] = []
+        self._lock = threading.Lock()  # ask_ai runs in worker threads
+
+        self.distance_threshold = distance_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def _embed(self, text: str):
+        vec = self._model.encode([text], normalize_embeddings=True)
+        return self._np.asarray(vec, dtype="float32")
+
+    def check(self, text: str) -> str | None:
+        vec = self._embed(text)
+        with self._lock:
+            if self._index.ntotal == 0:
+                return None
+            scores, ids = self._index.search(vec, 1)
+            i = int(ids[0][0])
+            if i < 0:
+                return None
+            # Inner product of unit vectors = cosine similarity
+            if 1.0 - float(scores[0][0]) > self.distance_threshold:
+                return None
+            if time.time() - self._timestamps[i] >= self.ttl:
+                return None
+            return self._responses[i]
+
+    def store(self, text: str, response: str):
+        vec = self._embed(text)
+        with self._lock:
+            self._index.add(vec)
+            self._responses.append(response)
+            self._timestamps.append(time.time())
+            if self._index.ntotal > self.max_entries:
+                # IndexFlat compacts ids on removal, matching the list positions
+                self._index.remove_ids(self._np.array([0], dtype="int64"))
+                del self._responses[0]
+                del self._timestamps[0]
+
+
+_CACHE: SemanticCache | None = None
+_CACHE_FAILED = False
+_CACHE_INIT_LOCK = threading.Lock()
+
+
+def get_cache() -> SemanticCache | None:
+    """
+    Return the process-wide cache, creating it on first use.
+    None when disabled or when the optional dependencies are unavailable.
+    """
+    global _CACHE, _CACHE_FAILED
+
+    if not SEMANTIC_CACHE or _CACHE_FAILED:
+        return None
+    if _CACHE is not None:
+        return _CACHE
+
+    with _CACHE_INIT_LOCK:
+        if _CACHE is None and not _CACHE_FAILED:
+            try:
+                _CACHE = SemanticCache(
+                    SEMANTIC_CACHE_MODEL,
+                    SEMANTIC_CACHE_DISTANCE,
+                    SEMANTIC_CACHE_TTL,
+                    SEMANTIC_CACHE_MAX,
+                )
+            except Exception as e:  # noqa: BLE001
+                _dbg("INIT_FAILED", repr(e))
+                _CACHE_FAILED = True
+    return _CACHE
@@ -2,13 +2,34 @@
 Vision provider wrapper.
 
 - Sends image bytes to an OpenAI-compatible vision endpoint
+  (base64 data URL in JSON, or raw bytes as multipart with VISION_UPLOAD_MODE)
+- Downscales large images first when Pillow is installed
+- Caches descriptions in SQLite by image content hash (+ model + prompt)
 - Returns a plain-text description of the image
 - Uses environment variables for all configuration
 """
 
+import io
 import os
+import json
+import time
 import base64
+import sqlite3
+import hashlib
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson  # optional: faster JSON encoding / parsing
+except ImportError:
+    orjson = None
+
+try:
+    from PIL import Image  # optional: downscale images before upload
+except ImportError:
+    Image = None
 
 # Keep debug behaviour aligned with providers.py
 DEBUG_MODE = os.getenv("DEBUG_MODE", "false").lower() in ("1", "true", "yes", "on")
@@ -30,33 +51,81 @@ VISION_API_KEY = os.getenv("VISION_API_KEY", "")
 VISION_MODEL = os.getenv("VISION_MODEL", "gpt-4o-mini")
 VISION_TIMEOUT = int(os.getenv("VISION_TIMEOUT", "60"))
 
+# "base64": JSON chat/completions with a data URL (works everywhere)
+# "multipart": POST the raw bytes as a file, skipping base64 (+33% size)
+# CUSTOMIZE: only use multipart if your endpoint accepts file uploads
+VISION_UPLOAD_MODE = os.getenv("VISION_UPLOAD_MODE", "base64").strip().lower()
+VISION_MULTIPART_URL = os.getenv("VISION_MULTIPART_URL", f"{VISION_API_BASE}/chat/completions")
 
-def describe_image(image_bytes: bytes, extra_prompt: str = "") -> str:
-    """
-    Call an OpenAI-compatible vision endpoint to describe an image.
+# Longest edge / JPEG quality for uploads (needs Pillow); small images are sent as-is
+VISION_MAX_EDGE = int(os.getenv("VISION_MAX_EDGE", "1024"))
+VISION_JPEG_Q = int(os.getenv("VISION_JPEG_Q", "85"))
+VISION_DOWNSCALE_MIN_BYTES = 200_000
 
-    Args:
-        image_bytes: Raw image bytes.
-        extra_prompt: Optional additional instruction for the model.
+# Description cache (forwarded stickers / memes repeat a lot); TTL 0 disables it
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+VISION_CACHE_DB = os.getenv(
+    "VISION_CACHE_DB", os.path.join(BASE_DIR, "data", "vision_cache.sqlite")
+)
+VISION_CACHE_TTL = int(os.getenv("VISION_CACHE_TTL", str(30 * 24 * 3600)))
 
-    Returns:
-        A text description from the model, or a string starting with
-        a diagnostic prefix (e.g. "[vision-http-...]" or "[vision-exception]") on error.
+# Dedicated pooled session for the vision host; its auth header never changes
+# (Content-Type is set per request: JSON headers or the multipart boundary)
+_VISION_SESSION = requests.Session()
+_VISION_ADAPTER = HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=Retry(total=0))
+_VISION_SESSION.mount("http://", _VISION_ADAPTER)
+_VISION_SESSION.mount("https://", _VISION_ADAPTER)
+_VISION_SESSION.headers["Authorization"] = f"Bearer {VISION_API_KEY}"
+
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def _downscale(image_bytes):
     """
-    _dbg("VISION_DESCRIBE_CALLED")
-    _dbg("VISION_KEY_PRESENT:", bool(VISION_API_KEY))
+    Shrink the longest edge to VISION_MAX_EDGE and re-encode as JPEG.
+    The model downsamples large images anyway, so this only cuts upload size
+    and image tokens. Returns the input unchanged on any failure.
+    """
+    if Image is None or len(image_bytes) < VISION_DOWNSCALE_MIN_BYTES:
+        return image_bytes
+    try:
+        im = Image.open(io.BytesIO(image_bytes))
+        im.thumbnail((VISION_MAX_EDGE, VISION_MAX_EDGE), Image.LANCZOS)
+        buf = io.BytesIO()
+        im.convert("RGB").save(buf, "JPEG", quality=VISION_JPEG_Q, optimize=True)
+    except Exception as e:  # noqa: BLE001
+        _dbg("VISION_DOWNSCALE_FAILED", repr(e))
+        return image_bytes
 
-    if not VISION_API_KEY:
-        return "Vision API key is missing."
+    out = buf.getvalue()
+    _dbg("VISION_DOWNSCALED", len(image_bytes), "->", len(out))
+    return out if len(out) < len(image_bytes) else image_bytes
 
-    # 1) Encode image as base64
-    b64 = base64.b64encode(image_bytes).decode("ascii")
 
-    # 2) Build request payload
-    url = f"{VISION_API_BASE}/chat/completions"
-    user_text = extra_prompt or "Please describe this image in detail."
+_B64_SLOT = "__IMAGE_B64__"
+
+
+def _dumps(obj) -> bytes:
+    # Keep aligned with providers._dumps
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(data: bytes):
+    # Keep aligned with providers._loads
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 
-    payload = {
+def _base64_body(image_bytes, user_text: str) -> bytes:
+    """
+    JSON body for the chat/completions request. The base64 image is spliced in
+    as bytes, so it never becomes a Python str or passes through the encoder.
+    """
+    head, tail = _dumps({
         "model": VISION_MODEL,
         "messages": [
             {
@@ -66,34 +135,134 @@ def describe_image(image_bytes: bytes, extra_prompt: str = "") -> str:
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{b64}"
+                            "url": f"data:image/jpeg;base64,{_B64_SLOT}"
                         },
                     },
                 ],
             }
         ],
         "max_tokens": 400,
-    }
+    }).split(_B64_SLOT.encode("ascii"), 1)
+    return b"".join((head, base64.b64encode(image_bytes), tail))
+
+
+def _describe_base64(image_bytes, user_text: str):
+    url = f"{VISION_API_BASE}/chat/completions"
+    body = _base64_body(image_bytes, user_text)
+    return _VISION_SESSION.post(url, data=body, headers=_JSON_HEADERS, timeout=VISION_TIMEOUT)
+
+
+def _describe_multipart(image_bytes, user_text: str):
+    if isinstance(image_bytes, memoryview):
+        image_bytes = image_bytes.tobytes()  # requests only takes bytes / file objects
+    return _VISION_SESSION.post(
+        VISION_MULTIPART_URL,
+        data={"model": VISION_MODEL, "prompt": user_text, "max_tokens": "400"},
+        files={"image": ("img.jpg", image_bytes, "image/jpeg")},
+        timeout=VISION_TIMEOUT,
+    )
+
+
+# --- Description cache ---
+
+_VCACHE: sqlite3.Connection | None = None
+_VCACHE_LOCK = threading.Lock()  # describe_image runs in worker threads
+
+
+def _vcache() -> sqlite3.Connection:
+    global _VCACHE
+    if _VCACHE is None:
+        os.makedirs(os.path.dirname(VISION_CACHE_DB) or ".", exist_ok=True)
+        conn = sqlite3.connect(VISION_CACHE_DB, check_same_thread=False)
+        conn.execute("CREATE TABLE IF NOT EXISTS v (k TEXT PRIMARY KEY, ts REAL, text TEXT)")
+        conn.commit()
+        _VCACHE = conn
+    return _VCACHE
+
+
+def _vcache_key(image_bytes, user_text: str) -> str:
+    h = hashlib.sha256(image_bytes)
+    h.update(b"\0" + VISION_MODEL.encode("utf-8"))
+    h.update(b"\0" + user_text.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _vcache_get(key: str) -> str | None:
+    try:
+        with _VCACHE_LOCK:
+            row = _vcache().execute("SELECT ts, text FROM v WHERE k = ?", (key,)).fetchone()
+    except (sqlite3.Error, OSError) as e:
+        _dbg("VISION_CACHE_ERROR", repr(e))
+        return None
+    if row and time.time() - row[0] < VISION_CACHE_TTL:
+        return row[1]
+    return None
+
+
+def _vcache_put(key: str, text: str):
+    try:
+        with _VCACHE_LOCK:
+            conn = _vcache()
+            conn.execute(
+                "INSERT OR REPLACE INTO v (k, ts, text) VALUES (?, ?, ?)",
+                (key, time.time(), text),
+            )
+            conn.commit()
+    except (sqlite3.Error, OSError) as e:
+        _dbg("VISION_CACHE_ERROR", repr(e))
+
+
+def describe_image(image_bytes: bytes | bytearray | memoryview, extra_prompt: str = "") -> str:
+    """
+    Call an OpenAI-compatible vision endpoint to describe an image.
+
+    Args:
+        image_bytes: Raw image bytes (bytes, bytearray or memoryview; not copied).
+        extra_prompt: Optional additional instruction for the model.
+
+    Returns:
+        A text description from the model, or a string starting with
+        a diagnostic prefix (e.g. "[vision-http-...]" or "[vision-exception]") on error.
+    """
+    _dbg("VISION_DESCRIBE_CALLED")
+    _dbg("VISION_KEY_PRESENT:", bool(VISION_API_KEY))
+
+    if not VISION_API_KEY:
+        return "Vision API key is missing."
+
+    user_text = extra_prompt or "Please describe this image in detail."
+
+    # Keyed on the original bytes, so a repeat also skips the downscale
+    cache_key = None
+    if VISION_CACHE_TTL > 0:
+        cache_key = _vcache_key(image_bytes, user_text)
+        cached = _vcache_get(cache_key)
+        if cached is not None:
+            _dbg("VISION_CACHE_HIT", cache_key[:12])
+            return cached
+
+    image_bytes = _downscale(image_bytes)
+    text = _request_description(image_bytes, user_text)
+
+    # Only real descriptions are cached, never diagnostics or empty text
+    if cache_key is not None and text and not text.startswith("[vision-"):
+        _vcache_put(cache_key, text)
+    return text
 
-    headers = {
-        "Authorization": f"Bearer {VISION_API_KEY}",
-        "Content-Type": "application/json",
-    }
 
+def _request_description(image_bytes, user_text: str) -> str:
     try:
-        resp = requests.post(
-            url,
-            json=payload,
-            headers=headers,
-            timeout=VISION_TIMEOUT,
-        )
+        if VISION_UPLOAD_MODE == "multipart":
+            resp = _describe_multipart(image_bytes, user_text)
+        else:
+            resp = _describe_base64(image_bytes, user_text)
         _dbg("VISION_HTTP_STATUS", resp.status_code)
 
         if resp.status_code != 200:
             _dbg("VISION_HTTP_ERROR_BODY", resp.text[:300])
             return f"[vision-http-{resp.status_code}] {resp.text[:200]}"
 
-        data = resp.json()
+        data = _loads(resp.content)
         _dbg("VISION_RESP_KEYS", list(data.keys()))
 
         # OpenAI-style: choices[0].message.content